@@ -1,4 +1,5 @@
-from .blasting import BlastnSearch
+from .blasting import BlastnSearch, BlastnSearchBatch
 from .blastdb_cache import BlastDBCache
+from .result_cache import ResultCache
 
-__all__ = ["BlastnSearch", "BlastDBCache"]
+__all__ = ["BlastnSearch", "BlastnSearchBatch", "BlastDBCache", "ResultCache"]
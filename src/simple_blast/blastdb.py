@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-import dateparser
 import datetime
 from typing import Optional
 
@@ -18,25 +17,40 @@ class BlastDBMetadata:
 class UnsupportedDatabaseFormatException(Exception):
     pass
 
+def _read_nin_through_title(nin_file, metadata):
+    # Reads the fields of the header up to and including the title.
+    metadata["format_version"] = int.from_bytes(nin_file.read(4))
+    if metadata["format_version"] < 4:
+        raise UnsupportedDatabaseFormatException(
+            "Cannot read database in format {}".format(
+                metadata["format_version"]
+            )
+        )
+    metadata["db_seqtype"] = "np"[int.from_bytes(nin_file.read(4))]
+    if (metadata["format_version"] >= 5):
+        metadata["volume"] = int.from_bytes(nin_file.read(4))
+    title_length = int.from_bytes(nin_file.read(4))
+    metadata["title"] = nin_file.read(title_length).decode("ascii")
+
+def read_nin_db_title(nin):
+    """Read only the title of the database from the index file nin."""
+    # The title comes early in the header, so we can skip parsing the date,
+    # which is comparatively slow.
+    metadata = {}
+    with open(nin, "rb") as nin_file:
+        _read_nin_through_title(nin_file, metadata)
+    return metadata["title"]
+
 def read_nin_metadata(nin):
+    # dateparser is slow to import and is only needed here.
+    import dateparser
     # This code is based on the CSeqDBIdxFile::CSeqDBIdxFile constructor from
     # the NCBI C++ Toolkit; the original code is credited to Kevin Bealer. In
     # the source distribution of NCBI BLAST+, the code can be found at
     # c++/src/objtools/blast/seqdb_reader/seqdbfile.cpp.
     metadata = {}
     with open(nin, "rb") as nin_file:
-        metadata["format_version"] = int.from_bytes(nin_file.read(4))
-        if metadata["format_version"] < 4:
-            raise UnsupportedDatabaseFormatException(
-                "Cannot read database in format {}".format(
-                    metadata["format_version"]
-                )
-            )
-        metadata["db_seqtype"] = "np"[int.from_bytes(nin_file.read(4))]
-        if (metadata["format_version"] >= 5):
-            metadata["volume"] = int.from_bytes(nin_file.read(4))
-        title_length = int.from_bytes(nin_file.read(4))
-        metadata["title"] = nin_file.read(title_length).decode("ascii")
+        _read_nin_through_title(nin_file, metadata)
         if metadata["format_version"] >= 5:
             lmdb_file_length = int.from_bytes(nin_file.read(4))
             metadata["lmdb_file"] = nin_file.read(
@@ -1,11 +1,14 @@
+import os
+import shutil
 import subprocess
 import tempfile
 import itertools
 from pathlib import Path
 from collections.abc import Iterable
 from collections import namedtuple
-from .blastdb import read_nin_metadata, UnsupportedDatabaseFormatException
+from .blastdb import read_nin_db_title, UnsupportedDatabaseFormatException
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # def read_nal_title(nal):
 #     with open(nal, "r") as nal_file:
@@ -21,44 +24,54 @@ import json
 #                     )
 
 def read_js_title(js):
-    with open(js, "r") as js_file:
+    with open(js, "rb") as js_file:
         return frozenset(
             map(
                 Path,
-                json.loads(js_file.read())["description"].split()
+                json.load(js_file)["description"].split()
             )
         )
 
 def read_nin_title(nin):
-    return frozenset(map(Path, read_nin_metadata(nin).title.split()))
+    return frozenset(map(Path, read_nin_db_title(nin).split()))
 
 title_parsers = {"*.njs": read_js_title, "*.nin": read_nin_title}
 
-def get_existing(location):
+def read_title(stem):
+    for ext, parser in title_parsers.items():
+        try:
+            return parser(next(stem.parent.glob(stem.name + ext))), stem
+        except (StopIteration, UnsupportedDatabaseFormatException):
+            pass
+    return None
+
+def get_existing(location, dirs=None, max_workers=32):
+    if dirs is None:
+        dirs = (p for p in Path(location).glob("*") if p.is_dir())
     path_stems = set(
         map(
             lambda x: x.parent / x.name.split(".")[0],
             itertools.chain(
-                *map(
-                    Path(location).glob,
-                    [
-                        "*/*.njs",
-                        "*/*.nin"
-                    ]
+                *(
+                    d.glob(pattern)
+                    for d in dirs
+                    for pattern in ["*.njs", "*.nin"]
                 )
             )
         )
     )
-    for stem in path_stems:
-        for ext, parser in title_parsers.items():
-            try:
-                yield parser(next(stem.parent.glob(stem.name + ext))), stem
-                break
-            except (StopIteration, UnsupportedDatabaseFormatException):
-                pass
+    # Reading titles is I/O bound, so the files are read in parallel.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for res in executor.map(read_title, path_stems):
+            if res is not None:
+                yield res
 
 
 def to_path_iterable(ix, cls=frozenset) -> Iterable[Path]:
+    # Keys that are already normalized (e.g., those precomputed by
+    # BlastnSearch) are returned as they are to avoid rebuilding them.
+    if type(ix) is cls and all(isinstance(p, Path) for p in ix):
+        return ix
     if isinstance(ix, str):
         ix = [Path(ix)]
     try:
@@ -80,6 +93,15 @@ def convert_index(f, self_i=0, paths_i=1):
     return inner
 
 class BlastDBCache:
+    __slots__ = (
+        "location",
+        "_cache",
+        "_find_existing",
+        "_scanned",
+        "_parse_seqids",
+        "_absolute",
+    )
+
     def __init__(
             self,
             location,
@@ -89,8 +111,11 @@ class BlastDBCache:
     ):
         self.location = location
         self._cache = {}
-        if find_existing:
-            self._cache = dict(get_existing(location))
+        # Existing DBs are found lazily, when a lookup misses. _scanned maps
+        # each DB directory that has been scanned to its modification time so
+        # that only new or changed directories are scanned again.
+        self._find_existing = find_existing
+        self._scanned = {}
         self._parse_seqids = parse_seqids
         self._absolute = absolute
 
@@ -102,6 +127,29 @@ class BlastDBCache:
     def parse_seqids(self):
         return self._parse_seqids
 
+    def _changed_dirs(self):
+        try:
+            entries = list(os.scandir(self.location))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            path = Path(entry.path).absolute()
+            mtime = entry.stat().st_mtime_ns
+            if self._scanned.get(path) != mtime:
+                self._scanned[path] = mtime
+                yield path
+
+    def _lookup(self, k):
+        if k not in self._cache and self._find_existing:
+            for titles, stem in get_existing(
+                    self.location,
+                    self._changed_dirs()
+            ):
+                self._cache.setdefault(titles, stem)
+        return k in self._cache
+
     def _build_makeblastdb_command(self, seq_file_paths, db_name):
         command = [
                 "makeblastdb",
@@ -117,10 +165,7 @@ class BlastDBCache:
             command.append("-parse_seqids")
         return command
 
-    @convert_index
-    def makedb(self, seq_file_paths):
-        if seq_file_paths in self._cache:
-            return
+    def _run_makeblastdb(self, seq_file_paths):
         prefix = next(iter(seq_file_paths)).stem
         if len(seq_file_paths) > 1:
             prefix = prefix + "+"
@@ -131,27 +176,80 @@ class BlastDBCache:
             )
         )
         db_name = str(tempdir / "db")
-        proc = subprocess.Popen(
-            self._build_makeblastdb_command(seq_file_paths, db_name),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        proc.communicate()
-        if proc.returncode:
-            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        try:
+            proc = subprocess.Popen(
+                self._build_makeblastdb_command(seq_file_paths, db_name),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            proc.communicate()
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        except BaseException:
+            # Otherwise, every failed run would leave behind a directory for
+            # later scans to walk.
+            shutil.rmtree(tempdir)
+            raise
+        return tempdir, db_name
+
+    def _add_db(self, seq_file_paths, tempdir, db_name):
         self._cache[seq_file_paths] = db_name
+        # We already know what this directory contains.
+        self._scanned[tempdir.absolute()] = tempdir.stat().st_mtime_ns
+
+    @convert_index
+    def _key(self, seq_file_paths):
+        return seq_file_paths
+
+    @convert_index
+    def makedb(self, seq_file_paths):
+        if self._lookup(seq_file_paths):
+            return
+        self._add_db(seq_file_paths, *self._run_makeblastdb(seq_file_paths))
+
+    def makedbs(self, seq_file_paths_list, absolute=False, max_workers=None):
+        """Make DBs for many sets of sequence files concurrently.
+
+        Each element of seq_file_paths_list is handled as the argument to
+        makedb would be. At most max_workers (by default, the number of CPUs)
+        makeblastdb processes are run at once. If any makeblastdb run fails,
+        the DBs that were made successfully are still added to the cache before
+        the first error is raised.
+        """
+        keys = dict.fromkeys(
+            self._key(k, absolute=absolute) for k in seq_file_paths_list
+        )
+        keys = [k for k in keys if not self._lookup(k)]
+        if max_workers is None:
+            max_workers = os.cpu_count()
+        # makeblastdb does the work in a subprocess, so threads suffice.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (k, executor.submit(self._run_makeblastdb, k)) for k in keys
+            ]
+        error = None
+        for k, future in futures:
+            try:
+                self._add_db(k, *future.result())
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
 
     @convert_index
     def get(self, k):
+        self._lookup(k)
         return self._cache[k]
 
     @convert_index
     def delete(self, k):
+        self._lookup(k)
         del self._cache[k]
 
     @convert_index
     def contains(self, k):
-        return k in self._cache
+        return self._lookup(k)
 
     def __getitem__(self, k):
         return self.get(k)
@@ -1,10 +1,24 @@
+import os
+import csv
+import shutil
+import tempfile
+import threading
 import subprocess
+import hashlib
+import functools
+import importlib.util
 import pandas as pd
 from collections.abc import Iterable
 from typing import List, Optional
 from pathlib import Path
 
 from .blastdb_cache import BlastDBCache, to_path_iterable
+from .result_cache import ResultCache, hash_file
+
+@functools.cache
+def _installed(module: str) -> bool:
+    # Checks whether an optional module is available without importing it.
+    return importlib.util.find_spec(module) is not None
 
 default_out_columns = ['qseqid',
  'sseqid',
@@ -21,6 +35,132 @@ default_out_columns = ['qseqid',
 
 yes_no = ["no", "yes"]
 
+# Size of the buffer used to read blastn's output. The default of 8 KiB means
+# many small reads for large outputs.
+_pipe_buffer_size = 1 << 20
+
+# Types of the numeric columns in blastn's tabular output. Columns not listed
+# here are parsed as strings; inferring their types would, for example, turn
+# numeric sequence IDs into integers.
+column_types = {
+    "qlen": "int64",
+    "slen": "int64",
+    "qstart": "int64",
+    "qend": "int64",
+    "sstart": "int64",
+    "send": "int64",
+    "evalue": "float64",
+    "bitscore": "float64",
+    "score": "int64",
+    "length": "int64",
+    "pident": "float64",
+    "nident": "int64",
+    "mismatch": "int64",
+    "positive": "int64",
+    "gapopen": "int64",
+    "gaps": "int64",
+    "ppos": "float64",
+    "qframe": "int64",
+    "sframe": "int64",
+    "qcovs": "int64",
+    "qcovhsp": "int64",
+    "qcovus": "int64",
+}
+
+def _empty_hits(columns) -> pd.DataFrame:
+    # The columns have the same types as those of a parsed output.
+    return pd.DataFrame(
+        {c: pd.Series(dtype=column_types.get(c, str)) for c in columns}
+    )
+
+def _read_hits_arrow(stream, columns) -> pd.DataFrame:
+    import pyarrow
+    import pyarrow.csv
+    # pyarrow refuses to read empty input, even when the columns are given.
+    if not stream.peek(1):
+        return _empty_hits(columns)
+    table = pyarrow.csv.read_csv(
+        stream,
+        read_options=pyarrow.csv.ReadOptions(column_names=list(columns)),
+        parse_options=pyarrow.csv.ParseOptions(
+            delimiter="\t",
+            quote_char=False
+        ),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={
+                c: pyarrow.type_for_alias(column_types.get(c, "string"))
+                for c in columns
+            }
+        )
+    )
+    # Release each column's Arrow memory as soon as it has been converted.
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def _read_hits_pandas(stream, columns) -> pd.DataFrame:
+    # blastn's tabular output is strictly tab-separated, so the C parser can
+    # be used, and it never contains quoted fields or missing values.
+    return pd.read_csv(
+        stream,
+        names=columns,
+        sep="\t",
+        dtype={c: column_types.get(c, str) for c in columns},
+        engine="c",
+        quoting=csv.QUOTE_NONE,
+        na_filter=False
+    )
+
+def _read_hits_polars(stream, columns) -> pd.DataFrame:
+    import polars
+    # polars also refuses to read empty input.
+    if not stream.peek(1):
+        return _empty_hits(columns)
+    return polars.read_csv(
+        stream,
+        separator="\t",
+        has_header=False,
+        new_columns=list(columns),
+        schema_overrides={
+            c: (
+                getattr(polars, column_types[c].capitalize())
+                if c in column_types
+                else polars.Utf8
+            )
+            for c in columns
+        },
+        quote_char=None
+    ).to_pandas()
+
+def read_hits(stream, columns, backend: Optional[str] = None) -> pd.DataFrame:
+    """Parse blastn tabular output with the given columns from a stream.
+
+    The backend may be "pyarrow", "polars", or "pandas". If no backend is
+    specified, pyarrow is used if it is installed. If the requested backend is
+    not installed, the output is parsed with pandas. (Converting polars output
+    to pandas requires pyarrow as well.)
+    """
+    if backend is None:
+        backend = "pyarrow"
+    if backend not in {"pyarrow", "polars", "pandas"}:
+        raise ValueError("Unknown backend {}.".format(repr(backend)))
+    if backend == "pyarrow" and _installed("pyarrow"):
+        return _read_hits_arrow(stream, columns)
+    if (
+            backend == "polars"
+            and _installed("polars")
+            and _installed("pyarrow")
+    ):
+        return _read_hits_polars(stream, columns)
+    return _read_hits_pandas(stream, columns)
+
+def _write_stdin(pipe, data: bytes):
+    # blastn may exit without reading all of its input, e.g. on an error,
+    # which is reported through its return code instead.
+    try:
+        pipe.write(data)
+        pipe.close()
+    except BrokenPipeError:
+        pass
+
 class NotInDatabaseError(Exception):
     pass
 
@@ -40,6 +180,27 @@ class BlastnSearch:
     Attributes:
         debug (bool): Whether to enable debug features for this instance.
     """
+    __slots__ = (
+        "_seq1_path",
+        "_subject_key",
+        "_seq2_path",
+        "_evalue",
+        "_hits",
+        "_out_columns",
+        "_db_cache",
+        "_threads",
+        "_dust",
+        "_task",
+        "_max_targets",
+        "_negative_seqidlist",
+        "_perc_identity",
+        "_result_cache",
+        "_backend",
+        "_extra_args",
+        "_option_args",
+        "debug",
+    )
+
     def __init__(
             self,
             subject: str | Path | Iterable[str] | Iterable[Path],
@@ -48,12 +209,14 @@ class BlastnSearch:
             out_columns: List[str] = default_out_columns,
             additional_columns: List[str] = [],
             db_cache: Optional[BlastDBCache] = None,
-            threads: int = 1,
+            threads: int = -1,
             dust: bool = True,
             task: Optional[str] = None,
             max_targets: int = 500,
             n_seqidlist: Optional[str] = None,
             perc_ident: int = 0,
+            result_cache: Optional[ResultCache] = None,
+            backend: Optional[str] = None,
             debug: bool = False
     ):
         """Construct a BlastnSearch with the specified settings.
@@ -85,39 +248,66 @@ class BlastnSearch:
         If the caller desires to include additional columns, it may provide
         them to the additional_columns parameter.
 
+        By default, the search uses as many threads as there are CPUs. The
+        number of threads does not change the results. Note that blastn ignores
+        the number of threads when searching a subject FASTA file rather than
+        a BLAST DB.
+
         Parameters:
             subject:            Path(s) to subject sequence FASTA file(s).
             query:              Path to query sequence FASTA file.
             evalue (float):     Expect value cutoff to use in BLAST search.
             out_columns:        Output columns to include in results.
             additional_columns: Additional output columns to include in results.
-            db_cache:           BlastDBCache that tells where to find BLAST DBs.
-            threads (int):      Number of threads to use for BLAST search.
+            db_cache:           BlastDBCache in which to find or make BLAST DBs.
+            threads (int):      Number of threads to use (-1 for all CPUs).
             dust (bool):        Filter low-complexity regions from search.
             task (str):         Parameter preset to use.
             max_targets (int):  Maximum number of target seqs to include.
             n_seqidlist (str):  Specifies seqids to ignore.
             perc_ident (int):   Percent identity cutoff.
+            result_cache:       ResultCache in which to store parsed results.
+            backend (str):      Library to use to parse the output.
             debug (bool):       Whether to enable debug features.
         """
         subject = to_path_iterable(subject, tuple)
         query = Path(query)
         self._seq1_path = subject
+        # Key used to look up the subject in the DB cache.
+        self._subject_key = frozenset(subject)
         self._seq2_path = query
         self._evalue = evalue
         self._hits = None
         self._out_columns = tuple(out_columns + additional_columns)
         self._db_cache = db_cache
-        self._threads =  threads
+        self._threads = threads if threads > 0 else (os.cpu_count() or 1)
         self._dust = dust
         self._task = task
         self._max_targets = max_targets
         self._negative_seqidlist = n_seqidlist
         self._perc_identity = perc_ident
+        self._result_cache = result_cache
+        self._backend = backend
         # If you really need to add extra arguments, you can do it by setting
         # the _extra_args attribute.
         self._extra_args = []
         self.debug = debug
+        # These arguments do not change, so they are converted to strings once
+        # rather than every time the command is built.
+        self._option_args = (
+            "-evalue",
+            str(self._evalue),
+            "-outfmt",
+            " ".join(["6", *self._out_columns]),
+            "-num_threads",
+            str(self._threads),
+            "-dust",
+            yes_no[self._dust],
+            "-max_target_seqs",
+            str(self._max_targets),
+            "-perc_identity",
+            str(self._perc_identity)
+        )
 
     @property
     def query(self) -> Path:
@@ -191,54 +381,310 @@ class BlastnSearch:
         """Return the percent identity cutoff to use."""
         return self._perc_identity
 
-    def _build_blast_command(self):
+    @property
+    def result_cache(self) -> Optional[ResultCache]:
+        """Return a cache of parsed results to be used for the search."""
+        return self._result_cache
+
+    @property
+    def backend(self) -> Optional[str]:
+        """Return the name of the library used to parse the output."""
+        return self._backend
+
+    def _result_key(self) -> str:
+        # Hash everything that affects the output: the subject, the query, the
+        # negative seqid list, and the search parameters. The number of
+        # threads does not change the results, so it is left out.
+        hasher = hashlib.blake2b(digest_size=32)
+        if (
+                self._db_cache is not None
+                and not all(p.exists() for p in self.seq1_path)
+        ):
+            # The subject's source files may be gone once its DB is made. The
+            # subject is then identified by the DB cache's location and key.
+            hasher.update(b"db\0")
+            location = Path(self._db_cache.location).resolve()
+            hasher.update(str(location).encode() + b"\0")
+            hasher.update(
+                "\0".join(
+                    sorted(map(str, self._db_cache._key(self._subject_key)))
+                ).encode()
+            )
+        else:
+            # A DB's subject files are unordered, so the order of the files'
+            # hashes must not matter.
+            hasher.update(b"subject\0")
+            digests = []
+            for p in self.seq1_path:
+                file_hasher = hashlib.blake2b(digest_size=32)
+                hash_file(p, file_hasher)
+                digests.append(file_hasher.digest())
+            for digest in sorted(digests):
+                hasher.update(digest)
+        hasher.update(b"query\0")
+        hash_file(self.seq2_path, hasher)
+        if self._negative_seqidlist is not None:
+            hasher.update(b"negative_seqidlist\0")
+            hash_file(self._negative_seqidlist, hasher)
+        hasher.update(repr(self._search_params()).encode())
+        return hasher.hexdigest()
+
+    def _search_params(self) -> tuple:
+        # Parameters other than the inputs that affect the search's output.
+        return (
+            self._out_columns,
+            self._evalue,
+            self._dust,
+            self._task,
+            self._max_targets,
+            self._negative_seqidlist,
+            self._perc_identity,
+            tuple(self._extra_args)
+        )
+
+    def _build_blast_command(self, query: Optional[str] = None):
         command = ["blastn"]
-        if self._db_cache and self.seq1_path in self._db_cache:
-            command = command + ["-db", str(self._db_cache[self.seq1_path])]
+        if self._db_cache and self._subject_key in self._db_cache:
+            command.extend(["-db", str(self._db_cache[self._subject_key])])
         elif len(self.seq1_path) > 1:
             raise NotInDatabaseError("Must use DB cache for multiple subjects.")
         else:
-            command = command + ["-subject", str(self.seq1_path[0])]
+            command.extend(["-subject", str(self.seq1_path[0])])
         if self._task is not None:
-            command = command + ["-task", self._task]
+            command.extend(["-task", self._task])
         if self._negative_seqidlist is not None:
-            command = command + [
-                "-negative_seqidlist",
-                self._negative_seqidlist
-            ]
-        command = command + [
-            "-query",
-            str(self.seq2_path),
-            "-evalue",
-            str(self.evalue),
-            "-outfmt",
-            " ".join(["6"] + list(self._out_columns)),
-            "-num_threads",
-            str(self._threads),
-            "-dust",
-            yes_no[self._dust],
-            "-max_target_seqs",
-            str(self._max_targets),
-            "-perc_identity",
-            str(self._perc_identity)
-        ] + self._extra_args
+            command.extend(["-negative_seqidlist", self._negative_seqidlist])
+        command.extend(
+            ["-query", str(self.seq2_path) if query is None else query]
+        )
+        command.extend(self._option_args)
+        command.extend(self._extra_args)
         return command
-            
+
+    def _subject_is_empty(self) -> bool:
+        # An empty subject FASTA cannot produce any hits, so there is no need
+        # to start blastn. DB subjects are not checked, since the files used
+        # to make the DB may no longer exist.
+        if (
+                (self._db_cache and self._subject_key in self._db_cache)
+                or len(self.seq1_path) != 1
+        ):
+            return False
+        try:
+            return os.path.getsize(self.seq1_path[0]) == 0
+        except OSError:
+            return False
+
+    def _index_subject(self):
+        # blastn must parse a -subject FASTA on every search, whereas a DB is
+        # built once and then memory-mapped, so subjects missing from the DB
+        # cache are added to it before searching.
+        if self._db_cache is not None:
+            self._db_cache.makedb(self._subject_key)
 
     def _get_hits(self):
-        proc = subprocess.Popen(
-            self._build_blast_command(),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        self._hits = pd.read_csv(
-            proc.stdout,
-            names=self._out_columns,
-            sep=r"\s+"
-        )
-        proc.communicate()
+        if self._subject_is_empty():
+            self._hits = _empty_hits(self._out_columns)
+            return
+        if self._result_cache is None:
+            self._index_subject()
+            self._hits = self._run_blast(self._build_blast_command())
+            return
+        key = self._result_key()
+        try:
+            self._hits = self._result_cache[key]
+        except KeyError:
+            # The subject is only indexed when blastn actually has to run.
+            self._index_subject()
+            self._hits = self._run_blast(self._build_blast_command())
+            self._result_cache[key] = self._hits
+
+    def _run_blast(
+            self,
+            command: List[str],
+            stdin: Optional[bytes] = None
+    ) -> pd.DataFrame:
+        with subprocess.Popen(
+                command,
+                bufsize=_pipe_buffer_size,
+                stdin=None if stdin is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+        ) as proc:
+            if stdin is not None:
+                # The input is written from another thread while the output
+                # is parsed, so that neither pipe can fill up and stall blastn.
+                feeder = threading.Thread(
+                    target=_write_stdin,
+                    args=(proc.stdin, stdin)
+                )
+                feeder.start()
+            hits = read_hits(proc.stdout, self._out_columns, self._backend)
+            if stdin is not None:
+                feeder.join()
+            proc.stderr.read()
         if proc.returncode:
             if self.debug:
                 from IPython import embed
                 embed()
             raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        return hits
+
+def read_fasta_ids(path) -> List[str]:
+    """Return the IDs of the sequences in a FASTA file."""
+    with open(path, "r") as fasta_file:
+        return [
+            l[1:].split(maxsplit=1)[0]
+            for l in fasta_file
+            if l.startswith(">")
+        ]
+
+class BlastnSearchBatch:
+    """A batch of blastn searches to be carried out with a single blastn run.
+
+    Running many searches against the same subject separately pays the cost of
+    starting blastn and loading the subject once per search. A
+    BlastnSearchBatch instead concatenates the queries of its searches, runs
+    blastn once, and splits the results among the searches by query ID.
+
+    All searches in a batch must have the same subject, DB cache, and
+    parameters, and must include qseqid in their output columns. Query IDs
+    (the first word of each FASTA header) must be unique across the batch.
+
+    The queries are passed to blastn through its standard input if their total
+    size is at most size_threshold bytes. Larger inputs are written to a
+    temporary file instead so that they need not be held in memory.
+    """
+    __slots__ = ("_searches", "_size_threshold")
+
+    def __init__(
+            self,
+            searches: Iterable[BlastnSearch],
+            size_threshold: int = 1 << 24
+    ):
+        """Construct a BlastnSearchBatch from the given searches.
+
+        Parameters:
+            searches:             The BlastnSearch objects to run together.
+            size_threshold (int): Maximum query size to pass through stdin.
+        """
+        self._searches = tuple(searches)
+        self._size_threshold = size_threshold
+        if not self._searches:
+            raise ValueError("A batch must contain at least one search.")
+        first = self._searches[0]
+        for search in self._searches[1:]:
+            if (
+                    search.seq1_path != first.seq1_path
+                    or search.db_cache is not first.db_cache
+                    or search._search_params() != first._search_params()
+            ):
+                raise ValueError(
+                    "Searches in a batch must share a subject and parameters."
+                )
+        if "qseqid" not in first.out_columns:
+            raise ValueError("Batched searches must output qseqid.")
+
+    @property
+    def searches(self) -> tuple[BlastnSearch]:
+        """Return the searches in the batch."""
+        return self._searches
+
+    @property
+    def size_threshold(self) -> int:
+        """Return the maximum total query size to pass through stdin."""
+        return self._size_threshold
+
+    @staticmethod
+    def _query_owners(searches) -> dict[str, int]:
+        owners = {}
+        for i, search in enumerate(searches):
+            for query_id in read_fasta_ids(search.query):
+                if owners.setdefault(query_id, i) != i:
+                    raise ValueError(
+                        "Query ID {} appears in multiple searches.".format(
+                            repr(query_id)
+                        )
+                    )
+        return owners
+
+    def _build_blast_command(self, query: str) -> List[str]:
+        first = self._searches[0]
+        command = first._build_blast_command(query=query)
+        # A batch has many queries, so splitting the work among threads by
+        # query is more efficient than blastn's default of splitting the DB.
+        # Threads are ignored with -subject.
+        if (
+                first.threads > 1
+                and "-db" in command
+                and "-mt_mode" not in command
+        ):
+            command.extend(["-mt_mode", "1"])
+        return command
+
+    def _run_blast(self, searches) -> pd.DataFrame:
+        first = self._searches[0]
+        # Newlines between the queries make sure each file's first header
+        # starts a new line.
+        size = sum(os.path.getsize(search.query) for search in searches)
+        if size <= self._size_threshold:
+            queries = []
+            for search in searches:
+                with open(search.query, "rb") as f:
+                    queries.append(f.read())
+            return first._run_blast(
+                self._build_blast_command(query="-"),
+                stdin=b"\n".join(queries)
+            )
+        fd, query_path = tempfile.mkstemp(suffix=".fasta")
+        try:
+            with os.fdopen(fd, "wb") as query_file:
+                for search in searches:
+                    with open(search.query, "rb") as f:
+                        shutil.copyfileobj(f, query_file)
+                    query_file.write(b"\n")
+            return first._run_blast(
+                self._build_blast_command(query=query_path)
+            )
+        finally:
+            os.remove(query_path)
+
+    def run(self):
+        """Run the searches and store the results in each search.
+
+        Searches whose results are found in their result caches are not run
+        again. The results of the others are stored in their result caches.
+        """
+        first = self._searches[0]
+        if first._subject_is_empty():
+            for search in self._searches:
+                search._hits = _empty_hits(search.out_columns)
+            return
+        pending = []
+        for search in self._searches:
+            key = None
+            if search.result_cache is not None:
+                key = search._result_key()
+                try:
+                    search._hits = search.result_cache[key]
+                    continue
+                except KeyError:
+                    pass
+            pending.append((search, key))
+        if not pending:
+            return
+        searches = [search for search, _ in pending]
+        owners = self._query_owners(searches)
+        first._index_subject()
+        hits = self._run_blast(searches)
+        owner = hits["qseqid"].map(owners)
+        if owner.isna().any():
+            raise ValueError("Could not match query IDs in blastn output.")
+        groups = dict(tuple(hits.groupby(owner, sort=False)))
+        for i, (search, key) in enumerate(pending):
+            try:
+                search._hits = groups[i].reset_index(drop=True)
+            except KeyError:
+                search._hits = hits.iloc[:0]
+            if key is not None:
+                search.result_cache[key] = search._hits
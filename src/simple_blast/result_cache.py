@@ -0,0 +1,86 @@
+import os
+import pickle
+import tempfile
+import functools
+import pandas as pd
+from pathlib import Path
+
+_hash_block_size = 1 << 20
+
+def hash_file(path, hasher):
+    """Update hasher with the contents of the file at path."""
+    with open(path, "rb") as f:
+        while block := f.read(_hash_block_size):
+            hasher.update(block)
+
+# Results may be large, so only the few most recently loaded are kept.
+@functools.lru_cache(maxsize=4)
+def _load_pickle(path: str, mtime_ns: int) -> pd.DataFrame:
+    # mtime_ns is part of the key so that replaced files are reloaded.
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+class ResultCache:
+    """An on-disk cache of parsed BLAST results.
+
+    Results are stored as pickled pandas dataframes in the cache's location,
+    one file per key. Keys are hex digests computed by BlastnSearch from the
+    contents of the input files and the search parameters.
+
+    Since results are stored as pickles, the cache location should only be
+    writable by trusted users.
+    """
+    __slots__ = ("location",)
+
+    def __init__(self, location: str | Path):
+        self.location = location
+        Path(location).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, k: str) -> Path:
+        return Path(self.location) / (k + ".pkl")
+
+    def get(self, k: str) -> pd.DataFrame:
+        path = self._path(k)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            raise KeyError(k)
+        return _load_pickle(str(path), mtime_ns).copy()
+
+    def put(self, k: str, hits: pd.DataFrame):
+        fd, temp_name = tempfile.mkstemp(
+            prefix=".tmp",
+            suffix=".pkl",
+            dir=self.location
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(hits, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, self._path(k))
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        # Results that were replaced need not be kept in memory.
+        _load_pickle.cache_clear()
+
+    def delete(self, k: str):
+        try:
+            self._path(k).unlink()
+        except FileNotFoundError:
+            raise KeyError(k)
+        _load_pickle.cache_clear()
+
+    def contains(self, k: str) -> bool:
+        return self._path(k).exists()
+
+    def __getitem__(self, k):
+        return self.get(k)
+
+    def __setitem__(self, k, v):
+        self.put(k, v)
+
+    def __delitem__(self, k):
+        self.delete(k)
+
+    def __contains__(self, k):
+        return self.contains(k)
@@ -0,0 +1,50 @@
+import datetime
+from simple_blast.blastdb import (
+    read_nin_metadata,
+    read_nin_db_title,
+    UnsupportedDatabaseFormatException
+)
+from .simple_blast_test import SimpleBlastTestCase
+
+def pack_string(s):
+    b = s.encode("ascii")
+    return len(b).to_bytes(4) + b
+
+def make_nin(format_version, title, date):
+    header = format_version.to_bytes(4) + (0).to_bytes(4)
+    if format_version >= 5:
+        header += (0).to_bytes(4)
+    header += pack_string(title)
+    if format_version >= 5:
+        header += pack_string("db.nos")
+    return (
+        header
+        + pack_string(date)
+        + (3).to_bytes(4)
+        + (1500).to_bytes(8, "little")
+        + (500).to_bytes(4)
+    )
+
+class TestBlastDB(SimpleBlastTestCase):
+    def test_read_nin(self):
+        title = "data/seqs_0.fasta data/seqs_1.fasta"
+        date = "Jan 2, 2024  3:04 PM"
+        for format_version in [4, 5]:
+            with open("db.nin", "wb") as nin:
+                nin.write(make_nin(format_version, title, date))
+            self.assertEqual(read_nin_db_title("db.nin"), title)
+            metadata = read_nin_metadata("db.nin")
+            self.assertEqual(metadata.format_version, format_version)
+            self.assertEqual(metadata.db_seqtype, "n")
+            self.assertEqual(metadata.title, title)
+            self.assertEqual(
+                metadata.date,
+                datetime.datetime(2024, 1, 2, 15, 4)
+            )
+            self.assertEqual(metadata.num_oids, 3)
+            self.assertEqual(metadata.vol_len, 1500)
+            self.assertEqual(metadata.max_len, 500)
+        with open("db.nin", "wb") as nin:
+            nin.write(make_nin(3, title, date))
+        with self.assertRaises(UnsupportedDatabaseFormatException):
+            read_nin_db_title("db.nin")
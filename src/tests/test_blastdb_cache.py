@@ -1,8 +1,15 @@
 import tempfile
 import shutil
 import os
-from simple_blast.blastdb_cache import BlastDBCache, get_existing
+import subprocess
+import json
+from simple_blast.blastdb_cache import (
+    BlastDBCache,
+    get_existing,
+    to_path_iterable
+)
 from simple_blast.blasting import BlastnSearch
+from .test_blastnsearch import temporary_os_environ
 from .simple_blast_test import (
     SimpleBlastTestCase,
     parse_blast_command
@@ -105,6 +112,34 @@ class TestBlastDBCache(SimpleBlastTestCase):
                 next(iter(existing)),
                 files
             )
+
+    def test_makedbs(self):
+        files = [
+            self.data_dir / ("seqs_{}.fasta".format(x)) for x in range(3)
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = BlastDBCache(temp_dir)
+            cache.makedb(files[0])
+            cache.makedbs([files[0], files[1:], files[1], files[1:]])
+            self.assertIn(files[0], cache)
+            self.assertIn(files[1], cache)
+            self.assertIn(files[1:], cache)
+            self.assertEqual(len(list(Path(temp_dir).glob("seqs_*"))), 3)
+            self.assertEqual(len(dict(get_existing(temp_dir))), 3)
+            with self.assertRaises(subprocess.CalledProcessError):
+                cache.makedbs([files[2], self.data_dir / "missing.fasta"])
+            self.assertIn(files[2], cache)
+            # The failed run leaves no directory behind.
+            self.assertEqual(len(list(Path(temp_dir).iterdir())), 4)
+
+    def test_makedb_failure_cleanup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = BlastDBCache(temp_dir)
+            with temporary_os_environ(PATH="."):
+                with self.assertRaises(FileNotFoundError):
+                    cache.makedb(self.data_dir / "seqs_0.fasta")
+            self.assertEqual(list(Path(temp_dir).iterdir()), [])
+
     def test_use_blastdb_cache(self):
         temp_files = {}
         for f in self.data_dir.glob("seqs_*.fasta"):
@@ -180,3 +215,66 @@ class TestBlastDBCache(SimpleBlastTestCase):
             cache.makedb(files)
             cache = BlastDBCache(temp_dir, find_existing=True)
             self.assertIn(files, cache)
+
+    def test_to_path_iterable(self):
+        self.assertEqual(to_path_iterable("foo"), frozenset([Path("foo")]))
+        self.assertEqual(
+            to_path_iterable(["foo", Path("bar")]),
+            frozenset([Path("foo"), Path("bar")])
+        )
+        self.assertEqual(to_path_iterable(Path("foo"), tuple), (Path("foo"),))
+        # Already-normalized keys are not rebuilt.
+        key = frozenset([Path("foo"), Path("bar")])
+        self.assertIs(to_path_iterable(key), key)
+        self.assertEqual(
+            to_path_iterable(frozenset(["foo"])),
+            frozenset([Path("foo")])
+        )
+
+    def test_find_existing_lazy(self):
+        def make_fake_db(location, name, files):
+            db_dir = Path(location) / name
+            db_dir.mkdir()
+            with open(db_dir / "db.njs", "w") as njs:
+                json.dump({"description": " ".join(files)}, njs)
+            return db_dir / "db"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first = make_fake_db(temp_dir, "a", ["a.fasta"])
+            cache = BlastDBCache(temp_dir)
+            # Nothing is read until a lookup misses.
+            self.assertEqual(cache._cache, {})
+            self.assertIn("a.fasta", cache)
+            self.assertEqual(cache["a.fasta"], first)
+            self.assertNotIn("b.fasta", cache)
+            # DBs added after the first scan are found on a miss.
+            second = make_fake_db(temp_dir, "b", ["b.fasta", "c.fasta"])
+            self.assertEqual(cache[["b.fasta", "c.fasta"]], second)
+            # Deleted entries are not rediscovered.
+            del cache["a.fasta"]
+            self.assertNotIn("a.fasta", cache)
+            cache = BlastDBCache(temp_dir, find_existing=False)
+            self.assertNotIn("a.fasta", cache)
+        # The location need not exist.
+        self.assertNotIn("a.fasta", BlastDBCache("nonexistent"))
+
+    def test_auto_makedb(self):
+        subject = self.data_dir / "seqs_0.fasta"
+        files = [self.data_dir / f"seqs_{x}.fasta" for x in range(1, 3)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = BlastDBCache(temp_dir)
+            search = BlastnSearch(
+                subject,
+                self.data_dir / "queries.fasta",
+                db_cache=cache
+            )
+            self.assertNotIn(subject, cache)
+            self.assertEqual(list(search.hits.sseqid), ["seq0"])
+            self.assertIn(subject, cache)
+            # Multiple subjects work without making a DB first.
+            search = BlastnSearch(
+                files,
+                self.data_dir / "queries.fasta",
+                db_cache=cache
+            )
+            self.assertCountEqual(list(search.hits.sseqid), ["seq4", "seq8"])
+            self.assertIn(files, cache)
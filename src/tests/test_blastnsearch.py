@@ -1,10 +1,21 @@
 import os
+import io
+import math
+import tempfile
+import subprocess
+import pandas as pd
+import unittest
+import unittest.mock
+from simple_blast import blasting
 from simple_blast.blasting import (
     BlastnSearch,
+    BlastnSearchBatch,
     default_out_columns,
-    NotInDatabaseError
+    NotInDatabaseError,
+    read_hits
 )
 from simple_blast.blastdb_cache import BlastDBCache
+from simple_blast.result_cache import ResultCache
 from pathlib import Path
 from contextlib import contextmanager
 from .simple_blast_test import (
@@ -12,6 +23,14 @@ from .simple_blast_test import (
     parse_blast_command,
 )
 
+example_output = (
+    b"from_seq0\tseq0\t100.000\t500\t0\t0\t1\t500\t1\t500\t1.02e-263\t924\n"
+    b"from_seq1\tseq1\t99.800\t500\t1\t0\t1\t500\t500\t1\t4.74e-262\t918\n"
+)
+
+def as_stream(b):
+    return io.BufferedReader(io.BytesIO(b))
+
 @contextmanager
 def temporary_os_environ(**kwargs):
     try:
@@ -221,6 +240,22 @@ class TestBlastnSearch(SimpleBlastTestCase):
             with self.assertRaises(FileNotFoundError):
                 search.hits
 
+    def test_empty_subject(self):
+        subject = self.data_dir / "empty.fasta"
+        subject.touch()
+        search = BlastnSearch(subject, self.data_dir / "queries.fasta")
+        # blastn should not be run at all.
+        with temporary_os_environ(PATH="."):
+            self.assertEqual(search.hits.shape[0], 0)
+        self.assertEqual(list(search.hits.columns), default_out_columns)
+        self.assertEqual(search.hits.evalue.dtype, "float64")
+        # The types match those of a non-empty parse.
+        parsed = blasting._read_hits_pandas(
+            as_stream(example_output),
+            default_out_columns
+        )
+        self.assertEqual(list(search.hits.dtypes), list(parsed.dtypes))
+
     def test_multiple_subjects(self):
         search = BlastnSearch(
             [self.data_dir / x for x in ["seqs_0.fasta", "seqs_1.fasta"]],
@@ -257,5 +292,228 @@ class TestBlastnSearch(SimpleBlastTestCase):
             list(search.hits.columns),
             default_out_columns + new_out_columns
         )
-        
 
+    def check_read_hits(self, read):
+        hits = read(as_stream(example_output), default_out_columns)
+        self.assertEqual(list(hits.columns), default_out_columns)
+        self.assertEqual(list(hits.qseqid), ["from_seq0", "from_seq1"])
+        self.assertEqual(list(hits.send), [500, 1])
+        self.assertEqual(hits.send.dtype, "int64")
+        for a, b in zip(hits.evalue, [1.02e-263, 4.74e-262]):
+            self.assertTrue(math.isclose(a, b))
+        self.assertEqual(hits.evalue.dtype, "float64")
+        hits = read(as_stream(b""), default_out_columns)
+        self.assertEqual(hits.shape[0], 0)
+        self.assertEqual(list(hits.columns), default_out_columns)
+        self.assertEqual(hits.send.dtype, "int64")
+        hits = read(
+            as_stream(b"seq0\t500\t498\n"),
+            ["sseqid", "slen", "nident"]
+        )
+        self.assertEqual(list(hits.slen), [500])
+        self.assertEqual(hits.nident.dtype, "int64")
+
+    def check_quotes(self, read):
+        # Quotes are not special in blastn's output.
+        hits = read(as_stream(b'"q1\ts1\n"q2\ts2\n'), ["qseqid", "sseqid"])
+        self.assertEqual(list(hits.qseqid), ['"q1', '"q2'])
+        self.assertEqual(list(hits.sseqid), ["s1", "s2"])
+
+    def check_string_ids(self, read):
+        # IDs that look like numbers must still be parsed as strings.
+        lines = [f"{i}\t{i}\n".encode() for i in range(1, 23)] + [b"23\tX\n"]
+        hits = read(as_stream(b"".join(lines)), ["qseqid", "sseqid"])
+        self.assertEqual(hits.qseqid.iloc[0], "1")
+        self.assertEqual(hits.sseqid.iloc[-1], "X")
+
+    def test_read_hits(self):
+        self.check_read_hits(read_hits)
+        self.check_read_hits(blasting._read_hits_pandas)
+        self.check_string_ids(blasting._read_hits_pandas)
+        self.check_quotes(blasting._read_hits_pandas)
+        for backend in ["pyarrow", "polars", "pandas"]:
+            read = lambda s, c: read_hits(s, c, backend=backend)
+            self.check_read_hits(read)
+            self.check_string_ids(read)
+            self.check_quotes(read)
+        with self.assertRaises(ValueError):
+            read_hits(as_stream(example_output), default_out_columns, "foo")
+
+    def test_read_hits_polars_without_pyarrow(self):
+        # polars needs pyarrow to convert its output to pandas, so pandas is
+        # used if only polars is installed.
+        installed = blasting._installed
+        with unittest.mock.patch.object(
+                blasting,
+                "_installed",
+                lambda module: module != "pyarrow" and installed(module)
+        ), unittest.mock.patch.object(
+                blasting,
+                "_read_hits_polars",
+                side_effect=AssertionError("polars was used")
+        ):
+            self.check_read_hits(
+                lambda s, c: read_hits(s, c, backend="polars")
+            )
+
+    @unittest.skipUnless(
+        blasting._installed("pyarrow"),
+        "pyarrow is not installed"
+    )
+    def test_read_hits_arrow(self):
+        self.check_read_hits(blasting._read_hits_arrow)
+        self.check_string_ids(blasting._read_hits_arrow)
+        self.check_quotes(blasting._read_hits_arrow)
+        # Types must not be fixed by the first block of a large output.
+        lines = [f"{i % 22 + 1}\t1\n".encode() for i in range(300000)]
+        hits = blasting._read_hits_arrow(
+            as_stream(b"".join(lines) + b"X\t1\n"),
+            ["sseqid", "length"]
+        )
+        self.assertEqual(hits.sseqid.iloc[-1], "X")
+
+    @unittest.skipUnless(
+        blasting._installed("polars") and blasting._installed("pyarrow"),
+        "polars or pyarrow is not installed"
+    )
+    def test_read_hits_polars(self):
+        self.check_read_hits(blasting._read_hits_polars)
+        self.check_string_ids(blasting._read_hits_polars)
+        self.check_quotes(blasting._read_hits_polars)
+        # Types must not be inferred from the first rows of the output.
+        lines = [f"{i % 22 + 1}\t1\n".encode() for i in range(1000)]
+        hits = blasting._read_hits_polars(
+            as_stream(b"".join(lines) + b"X\t1\n"),
+            ["sseqid", "length"]
+        )
+        self.assertEqual(hits.sseqid.iloc[-1], "X")
+
+    def test_batch_construction(self):
+        query_path = self.data_dir / "queries.fasta"
+        subject_path = self.data_dir / "seqs_0.fasta"
+        searches = [BlastnSearch(subject_path, query_path) for _ in range(2)]
+        batch = BlastnSearchBatch(searches)
+        self.assertEqual(list(batch.searches), searches)
+        self.assertEqual(batch.size_threshold, 1 << 24)
+        with self.assertRaises(ValueError):
+            BlastnSearchBatch([])
+        with self.assertRaises(ValueError):
+            BlastnSearchBatch(
+                [
+                    BlastnSearch(subject_path, query_path),
+                    BlastnSearch(self.data_dir / "seqs_1.fasta", query_path)
+                ]
+            )
+        with self.assertRaises(ValueError):
+            BlastnSearchBatch(
+                [
+                    BlastnSearch(subject_path, query_path),
+                    BlastnSearch(subject_path, query_path, evalue=1)
+                ]
+            )
+        with self.assertRaises(ValueError):
+            BlastnSearchBatch(
+                [BlastnSearch(subject_path, query_path, out_columns=["sseqid"])]
+            )
+        # The same query IDs appear in both searches.
+        with self.assertRaises(ValueError):
+            batch.run()
+
+    def test_run_blast_stdin(self):
+        search = BlastnSearch(
+            self.data_dir / "seqs_0.fasta",
+            self.data_dir / "queries.fasta",
+            out_columns=["qseqid", "sseqid"]
+        )
+        # The input and output are both larger than a pipe's buffer, so they
+        # must be written and read at the same time.
+        data = b"".join(f"q{i}\ts{i}\n".encode() for i in range(100000))
+        hits = search._run_blast(["cat"], stdin=data)
+        self.assertEqual(len(hits), 100000)
+        self.assertEqual(list(hits.iloc[-1]), ["q99999", "s99999"])
+        with self.assertRaises(subprocess.CalledProcessError):
+            search._run_blast(["false"], stdin=data)
+
+    def test_batch_command(self):
+        subject_path = self.data_dir / "seqs_0.fasta"
+        query_path = self.data_dir / "queries.fasta"
+        self.assertEqual(
+            BlastnSearch(subject_path, query_path).threads,
+            os.cpu_count() or 1
+        )
+        cache = BlastDBCache("example_dir", find_existing=False)
+        cache._cache[frozenset([subject_path])] = "my_db"
+        for threads, db_cache, mt_mode in [
+                (4, cache, "1"),
+                (1, cache, None),
+                (4, None, None)
+        ]:
+            batch = BlastnSearchBatch(
+                [
+                    BlastnSearch(
+                        subject_path,
+                        query_path,
+                        threads=threads,
+                        db_cache=db_cache
+                    )
+                ]
+            )
+            args, kwargs = parse_blast_command(
+                batch._build_blast_command("batch.fasta")[1:]
+            )
+            self.assertEqual(kwargs["query"], "batch.fasta")
+            self.assertEqual(kwargs["num_threads"], str(threads))
+            self.assertEqual(kwargs.get("mt_mode"), mt_mode)
+
+    def test_batch_result_cache(self):
+        subject = self.data_dir / "seqs_0.fasta"
+        queries = []
+        for i in range(2):
+            queries.append(self.data_dir / f"query_{i}.fasta")
+            queries[-1].write_text(f">{i}\nACGT\n")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResultCache(temp_dir)
+            searches = [
+                BlastnSearch(subject, q, result_cache=cache) for q in queries
+            ]
+            expected = []
+            for i, search in enumerate(searches):
+                expected.append(pd.DataFrame({"qseqid": [str(i)]}))
+                cache[search._result_key()] = expected[-1]
+            # blastn must not be run when every search is cached.
+            with temporary_os_environ(PATH="."):
+                BlastnSearchBatch(searches).run()
+            for e, search in zip(expected, searches):
+                self.assertTrue(search.hits.equals(e))
+
+    def test_batch(self):
+        queries = []
+        with open(self.data_dir / "queries.fasta") as query_file:
+            records = query_file.read().split(">")[1:]
+        for i, record in enumerate(records):
+            queries.append(self.data_dir / f"query_{i}.fasta")
+            with open(queries[-1], "w") as f:
+                f.write(">" + record)
+        subject = self.data_dir / "seqs_0.fasta"
+        expected = [BlastnSearch(subject, q).hits for q in queries]
+        # Test passing the queries through both stdin and a file.
+        for size_threshold in [1 << 24, 0]:
+            searches = [BlastnSearch(subject, q) for q in queries]
+            BlastnSearchBatch(searches, size_threshold=size_threshold).run()
+            for e, search in zip(expected, searches):
+                self.assertEqual(
+                    search.hits.to_dict("list"),
+                    e.to_dict("list")
+                )
+        # Results are stored in the searches' result caches.
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResultCache(temp_dir)
+            searches = [
+                BlastnSearch(subject, q, result_cache=cache) for q in queries
+            ]
+            BlastnSearchBatch(searches).run()
+            for e, search in zip(expected, searches):
+                self.assertEqual(
+                    cache[search._result_key()].to_dict("list"),
+                    e.to_dict("list")
+                )
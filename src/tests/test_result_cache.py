@@ -0,0 +1,167 @@
+import shutil
+import tempfile
+import pandas as pd
+from simple_blast.result_cache import ResultCache, _load_pickle
+from simple_blast.blasting import BlastnSearch
+from simple_blast.blastdb_cache import BlastDBCache
+from .simple_blast_test import SimpleBlastTestCase
+from .test_blastnsearch import temporary_os_environ
+from pathlib import Path
+
+class TestResultCache(SimpleBlastTestCase):
+    def test_put_get(self):
+        df = pd.DataFrame({"qseqid": ["a", "b"], "evalue": [1e-30, 1e-25]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResultCache(temp_dir)
+            self.assertEqual(cache.location, temp_dir)
+            self.assertNotIn("foo", cache)
+            with self.assertRaises(KeyError):
+                cache["foo"]
+            cache["foo"] = df
+            self.assertIn("foo", cache)
+            self.assertFileExists(Path(temp_dir) / "foo.pkl")
+            self.assertTrue(cache["foo"].equals(df))
+            # Results should persist across cache instances.
+            cache = ResultCache(temp_dir)
+            self.assertTrue(cache["foo"].equals(df))
+            del cache["foo"]
+            self.assertNotIn("foo", cache)
+            with self.assertRaises(KeyError):
+                del cache["foo"]
+            # Deleted results are not kept in memory.
+            self.assertEqual(_load_pickle.cache_info().currsize, 0)
+
+    def test_result_key(self):
+        subject = self.data_dir / "seqs_0.fasta"
+        query = self.data_dir / "queries.fasta"
+        key = BlastnSearch(subject, query)._result_key()
+        self.assertEqual(key, BlastnSearch(subject, query)._result_key())
+        # Threads do not affect the output.
+        self.assertEqual(
+            key,
+            BlastnSearch(subject, query, threads=4)._result_key()
+        )
+        self.assertNotEqual(
+            key,
+            BlastnSearch(subject, query, evalue=1e-10)._result_key()
+        )
+        self.assertNotEqual(
+            key,
+            BlastnSearch(
+                self.data_dir / "seqs_1.fasta",
+                query
+            )._result_key()
+        )
+        # Changing the contents of a file changes the key.
+        with open(query, "a") as query_file:
+            query_file.write(">extra\nACGT\n")
+        self.assertNotEqual(key, BlastnSearch(subject, query)._result_key())
+        seqidlist = self.data_dir / "seqidlist.txt"
+        seqidlist.write_text("seq0\n")
+        key = BlastnSearch(
+            subject,
+            query,
+            n_seqidlist=str(seqidlist)
+        )._result_key()
+        seqidlist.write_text("seq1\n")
+        self.assertNotEqual(
+            key,
+            BlastnSearch(
+                subject,
+                query,
+                n_seqidlist=str(seqidlist)
+            )._result_key()
+        )
+
+    def test_result_key_db(self):
+        subjects = [self.data_dir / f"seqs_{x}.fasta" for x in range(2)]
+        query = self.data_dir / "queries.fasta"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = BlastDBCache(temp_dir, find_existing=False)
+            key = BlastnSearch(subjects, query, db_cache=cache)._result_key()
+            # The key does not depend on whether or where the DB was made, or
+            # on the order of the subjects.
+            cache._cache[frozenset(subjects)] = "relative/db"
+            self.assertEqual(
+                key,
+                BlastnSearch(subjects, query, db_cache=cache)._result_key()
+            )
+            cache._cache[frozenset(subjects)] = "/absolute/db"
+            self.assertEqual(
+                key,
+                BlastnSearch(
+                    subjects[::-1],
+                    query,
+                    db_cache=cache
+                )._result_key()
+            )
+            # The subject files are not needed once the DB is made. The DB is
+            # then identified by the cache.
+            for s in subjects:
+                s.unlink()
+            key = BlastnSearch(subjects, query, db_cache=cache)._result_key()
+            self.assertEqual(
+                key,
+                BlastnSearch(subjects, query, db_cache=cache)._result_key()
+            )
+            with tempfile.TemporaryDirectory() as other_dir:
+                other_cache = BlastDBCache(other_dir, find_existing=False)
+                self.assertNotEqual(
+                    key,
+                    BlastnSearch(
+                        subjects,
+                        query,
+                        db_cache=other_cache
+                    )._result_key()
+                )
+
+    def test_result_key_db_contents(self):
+        # Subjects with the same path but different contents, such as files
+        # edited in place or the same relative path in different projects,
+        # must not share results.
+        subject = Path("s.fasta")
+        query = self.data_dir / "queries.fasta"
+        keys = []
+        for x in range(2):
+            shutil.copy(self.data_dir / f"seqs_{x}.fasta", subject)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                cache = BlastDBCache(temp_dir, find_existing=False)
+                keys.append(
+                    BlastnSearch(subject, query, db_cache=cache)._result_key()
+                )
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_search_uses_cache(self):
+        df = pd.DataFrame({"qseqid": ["from_seq0"], "sseqid": ["seq0"]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResultCache(temp_dir)
+            search = BlastnSearch(
+                self.data_dir / "seqs_0.fasta",
+                self.data_dir / "queries.fasta",
+                result_cache=cache
+            )
+            self.assertIs(search.result_cache, cache)
+            cache[search._result_key()] = df
+            # blastn must not be needed on a cache hit.
+            with temporary_os_environ(PATH="."):
+                self.assertTrue(search.hits.equals(df))
+
+    def test_search_uses_cache_before_makedb(self):
+        df = pd.DataFrame({"qseqid": ["from_seq0"], "sseqid": ["seq0"]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResultCache(Path(temp_dir) / "results")
+            db_cache = BlastDBCache(
+                Path(temp_dir) / "dbs",
+                find_existing=False
+            )
+            search = BlastnSearch(
+                self.data_dir / "seqs_0.fasta",
+                self.data_dir / "queries.fasta",
+                db_cache=db_cache,
+                result_cache=cache
+            )
+            cache[search._result_key()] = df
+            # makeblastdb must not be needed on a cache hit.
+            with temporary_os_environ(PATH="."):
+                self.assertTrue(search.hits.equals(df))
+            self.assertNotIn(search._subject_key, db_cache._cache)